@@ -0,0 +1,58 @@
+"""
+Benchmarks the throughput and memory of NearDuplicateIndex on synthetic
+phrases, a fraction of which are reposts with a word changed.
+
+    python bench_dedup.py [num phrases] [repost fraction]
+"""
+import random
+import sys
+import time
+
+from phrase_dedup import NearDuplicateIndex
+from sentence_generator import peak_resident_memory
+
+NUM_PHRASES = 1000000
+REPOST_FRACTION = 0.1
+VOCAB = ["word%d" % i for i in xrange(20000)]
+REPORT_INTERVAL = 100000
+
+def generate_phrases(num_phrases, repost_fraction, rand):
+    """
+    Yields num_phrases random phrases of 5 to 30 words, reposting
+    a previous phrase with one word replaced at the given fraction.
+    """
+    previous = []
+    for _ in xrange(num_phrases):
+        if previous and rand.random() < repost_fraction:
+            words = list(rand.choice(previous))
+            words[rand.randrange(len(words))] = rand.choice(VOCAB)
+        else:
+            words = [rand.choice(VOCAB) for _ in xrange(rand.randint(5, 30))]
+            if len(previous) < 10000:
+                previous.append(words)
+            else:
+                previous[rand.randrange(len(previous))] = words
+        yield " ".join(words)
+
+def run(num_phrases, repost_fraction):
+    """
+    Inserts the synthetic phrases into an index and prints the phrases
+    per second, near-duplicates found, bytes held by the index and the
+    peak resident memory of the process.
+    """
+    index = NearDuplicateIndex()
+    duplicates = 0
+    start = time.time()
+    for count, phrase in enumerate(generate_phrases(num_phrases, repost_fraction, \
+                                                    random.Random(0)), 1):
+        if not index.insert(phrase):
+            duplicates += 1
+        if count % REPORT_INTERVAL == 0 or count == num_phrases:
+            elapsed = time.time() - start
+            print "%d phrases: %.0f phrases/sec, %d near-duplicates, index %.1f MB, " \
+                  "peak resident memory %.1f MB" % (count, count / elapsed, duplicates, \
+                  index.memory_usage() / 1024.0 ** 2, peak_resident_memory() / 1024.0 ** 2)
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PHRASES,
+        float(sys.argv[2]) if len(sys.argv) > 2 else REPOST_FRACTION)
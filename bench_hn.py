@@ -0,0 +1,98 @@
+"""
+Benchmarks the HN item API ingestion path against the BeautifulSoup
+HTML path using recorded fixtures, reporting stories per minute.
+
+Record fixtures for the current top stories (requires network access):
+    python bench_hn.py record fixtures/hn_fixtures.json [num stories]
+Replay them, optionally simulating the latency of each request in ms:
+    python bench_hn.py run fixtures/hn_fixtures.json [latency]
+"""
+import json
+import logging
+import Queue
+import re
+import StringIO
+import sys
+import time
+
+import scraper
+
+from bs4 import BeautifulSoup # for parsing HackerNews
+from scraper import Scraper
+
+NUM_STORIES = 10
+NUM_ROUNDS = 3
+HN_SOUP_STRIP_RE = re.compile('<[^<]+?>|reply|\n')
+
+def gather_hn_html_data(scrape, entries):
+    """
+    Gathers data from Hacker News the way Scraper did before it used
+    the item API, by parsing the HTML page of each post in entries.
+    """
+    for entry in entries:
+        response = scraper.urllib2.urlopen(scraper.HN_BASE_API_ENDPOINT + str(entry)).read()
+        soup = BeautifulSoup(response, "html.parser")
+        all_comments = soup.findAll("span", {"class" : "comment"})
+        for comment in all_comments:
+            cleaned_html = HN_SOUP_STRIP_RE.sub("", comment.text)
+            cleaned_data = Scraper._clean_data(cleaned_html)
+            scrape.output.put(cleaned_data)
+
+def record(path, num_stories):
+    """
+    Fetches the HTML page and the item tree of the top stories and
+    writes every response to path, keyed by url.
+    """
+    responses = {}
+    urlopen = scraper.urllib2.urlopen
+
+    def recording_urlopen(url, timeout=None):
+        body = urlopen(url, timeout=timeout).read()
+        responses[url] = body
+        return StringIO.StringIO(body)
+
+    scraper.urllib2.urlopen = recording_urlopen
+    stories = Scraper(logging).hackernews.top_stories()[:num_stories]
+    for _ in Scraper.iter_hn_phrases(stories):
+        pass
+    for story in stories:
+        recording_urlopen(scraper.HN_BASE_API_ENDPOINT + str(story))
+
+    with open(path, "w") as fixture:
+        json.dump({"stories" : stories, "responses" : responses}, fixture)
+    print "Recorded %d responses for %d stories" % (len(responses), len(stories))
+
+def run(path, latency):
+    """
+    Replays the fixtures at path through both HN paths and prints the
+    stories per minute and phrases gathered by each.
+    """
+    with open(path) as fixture:
+        fixtures = json.load(fixture)
+    stories, responses = fixtures["stories"], fixtures["responses"]
+
+    def replaying_urlopen(url, timeout=None):
+        time.sleep(latency)
+        return StringIO.StringIO(responses[url].encode("utf8"))
+
+    scraper.urllib2.urlopen = replaying_urlopen
+    paths = [("BeautifulSoup HTML", gather_hn_html_data), \
+             ("item API", lambda scrape, entries: scrape._gather_hn_data(entries))]
+    for name, gather in paths:
+        scrape = Scraper(logging)
+        scrape.output = Queue.Queue()
+        start = time.time()
+        for _ in xrange(NUM_ROUNDS):
+            gather(scrape, stories)
+        elapsed = time.time() - start
+        print "%s: %.1f stories/min, %d phrases" % (name, \
+                NUM_ROUNDS * len(stories) * 60 / elapsed, scrape.output.qsize() / NUM_ROUNDS)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("record", "run"):
+        print __doc__
+        sys.exit(1)
+    if sys.argv[1] == "record":
+        record(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else NUM_STORIES)
+    else:
+        run(sys.argv[2], float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0)
@@ -0,0 +1,273 @@
+"""
+Detects near-duplicate phrases using MinHash signatures
+with LSH banding before they are trained on.
+"""
+import array
+import logging
+import os
+import random
+import re
+import sys
+import zlib
+import psycopg2
+
+from itertools import izip
+
+from sentence_generator import SentenceGenerator
+
+MERSENNE_PRIME = (1 << 31) - 1  # modulus of the hashes that simulate permutations
+NON_WORD_RE = re.compile(r"[^\w\s]+")
+EMPTY = -1  # marks a free slot in the band table
+MAX_LOAD = 0.7  # the band table is doubled beyond this fraction of used slots
+
+class NearDuplicateIndex(object):
+    """
+    An index of phrases that answers whether a new phrase is a
+    near-duplicate of one already indexed. Phrases are shingled into
+    word bigrams and each phrase's MinHash signature is split into
+    bands; phrases sharing a band are candidates, which are confirmed
+    by the Jaccard similarity of their shingles.
+
+    To stay small at millions of phrases, only the band keys and the
+    hashed shingles of each phrase are kept, in flat arrays: the band
+    keys in an open addressing table of (key, position) slots, and the
+    shingles back to back with the offset of each phrase's.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=64, num_bands=16, seed=1):
+        """
+        Constructs an empty index. Phrases whose shingles have a Jaccard
+        similarity of at least threshold are near-duplicates. The param,
+        num_perm, is the length of each signature and must be divisible
+        by num_bands. The defaults make phrases at least 0.5 similar
+        likely candidates, so few at the threshold are missed.
+        """
+        if num_perm % num_bands:
+            raise ValueError("num_perm must be divisible by num_bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.rows = num_perm / num_bands
+        self.shingles = array.array("I")
+        self.offsets = array.array("L", [0])
+        self.used_slots = 0
+        self.slot_keys = array.array("I", [0]) * 1024
+        self.slot_positions = array.array("i", [EMPTY]) * 1024
+
+        rand = random.Random(seed)
+        self.permutations = [(rand.randint(1, MERSENNE_PRIME - 1), \
+                              rand.randint(0, MERSENNE_PRIME - 1)) for _ in xrange(num_perm)]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def memory_usage(self):
+        """
+        Returns the bytes held by the arrays of the index.
+        """
+        return sum(values.buffer_info()[1] * values.itemsize for values in \
+                   (self.shingles, self.offsets, self.slot_keys, self.slot_positions))
+
+    @classmethod
+    def _shingle(cls, phrase):
+        """
+        Splits the phrase into a set of lowercased word bigrams, or
+        its single word if it only has one.
+        """
+        words = NON_WORD_RE.sub("", phrase.lower()).split()
+        if len(words) < 2:
+            return set(words)
+        return set(" ".join(pair) for pair in zip(words, words[1:]))
+
+    @classmethod
+    def _hash_shingles(cls, phrase):
+        """
+        Returns the sorted, distinct hashes of the shingles of the phrase.
+        """
+        return sorted(set(zlib.crc32(shingle) & MERSENNE_PRIME \
+                          for shingle in cls._shingle(phrase)))
+
+    def _signature(self, hashes):
+        """
+        Computes the MinHash signature of a phrase's shingle hashes.
+        """
+        return [min([(a * h + b) % MERSENNE_PRIME for h in hashes]) for a, b in self.permutations]
+
+    def signature(self, phrase):
+        """
+        Computes the MinHash signature of the phrase.
+        Returns None if the phrase has no words.
+        """
+        hashes = self._hash_shingles(phrase)
+        return self._signature(hashes) if hashes else None
+
+    def _band_keys(self, signature):
+        """
+        Returns the key of the signature within each band, which also
+        identifies the band so that all bands share one table.
+        """
+        rows = self.rows
+        return [hash((i, tuple(signature[i : i + rows]))) & 0xffffffff \
+                for i in xrange(0, self.num_perm, rows)]
+
+    def _candidates(self, key):
+        """
+        Yields the positions of the phrases indexed under key.
+        """
+        keys, positions = self.slot_keys, self.slot_positions
+        mask = len(keys) - 1
+        slot = key & mask
+        while positions[slot] != EMPTY:
+            if keys[slot] == key:
+                yield positions[slot]
+            slot = (slot + 1) & mask
+
+    def _add_slot(self, key, position):
+        """
+        Stores position under key in the first free slot from key onwards.
+        """
+        positions = self.slot_positions
+        mask = len(positions) - 1
+        slot = key & mask
+        while positions[slot] != EMPTY:
+            slot = (slot + 1) & mask
+        self.slot_keys[slot] = key
+        positions[slot] = position
+
+    def _grow(self):
+        """
+        Doubles the band table and reinserts every slot.
+        """
+        keys, positions = self.slot_keys, self.slot_positions
+        self.slot_keys = array.array("I", [0]) * (len(keys) * 2)
+        self.slot_positions = array.array("i", [EMPTY]) * (len(keys) * 2)
+        for key, position in izip(keys, positions):
+            if position != EMPTY:
+                self._add_slot(key, position)
+
+    def _similarity(self, hashes, position):
+        """
+        Computes the Jaccard similarity of hashes and the shingles of
+        the indexed phrase at position.
+        """
+        indexed = set(self.shingles[self.offsets[position] : self.offsets[position + 1]])
+        shared = len(indexed.intersection(hashes))
+        return shared / float(len(indexed) + len(hashes) - shared)
+
+    def _find_duplicate(self, hashes, band_keys):
+        """
+        Returns the position of an indexed near-duplicate of the
+        phrase with the given shingle hashes, or None if there is none.
+        """
+        checked = set()
+        for key in band_keys:
+            for candidate in self._candidates(key):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if self._similarity(hashes, candidate) >= self.threshold:
+                    return candidate
+        return None
+
+    def is_duplicate(self, phrase):
+        """
+        Checks to see if the phrase is a near-duplicate of an indexed
+        phrase, true if so, false otherwise.
+        """
+        hashes = self._hash_shingles(phrase)
+        if not hashes:
+            return False
+        band_keys = self._band_keys(self._signature(hashes))
+        return self._find_duplicate(hashes, band_keys) is not None
+
+    def insert(self, phrase):
+        """
+        Indexes the phrase unless it is a near-duplicate of an indexed
+        phrase. Returns false if it is a near-duplicate, true otherwise,
+        including for a phrase without words, which is never indexed.
+        """
+        hashes = self._hash_shingles(phrase)
+        if not hashes:
+            return True
+
+        band_keys = self._band_keys(self._signature(hashes))
+        if self._find_duplicate(hashes, band_keys) is not None:
+            return False
+
+        position = len(self)
+        self.shingles.extend(hashes)
+        self.offsets.append(len(self.shingles))
+        self.used_slots += len(band_keys)
+        if self.used_slots > MAX_LOAD * len(self.slot_keys):
+            self._grow()
+        for key in band_keys:
+            self._add_slot(key, position)
+        return True
+
+
+def model_stats(phrases):
+    """
+    Trains a model the way SentenceGenerator does on phrases.
+    Returns a tuple of its (states, transitions, estimated bytes).
+    """
+    model = {}
+    for phrase in phrases:
+        SentenceGenerator._train_phrase(model, phrase, 1.0)
+    transitions = sum(len(pos_states) for pos_states in model.itervalues())
+    return len(model), transitions, SentenceGenerator._model_memory(model)
+
+def load_phrase_index(logger):
+    """
+    Builds a NearDuplicateIndex of every phrase in the PostgresDB. The
+    index grows with the table, by roughly 350 MB per million phrases.
+    """
+    logger.debug("Indexing phrases from the DB...")
+    conn = psycopg2.connect(database=os.environ["DATABASE"], user=os.environ["USER"])
+    cur = conn.cursor()
+    cur.execute("SELECT phrase FROM phrases ORDER BY fetch_date")
+
+    index = NearDuplicateIndex()
+    for phrase, in cur:
+        index.insert(phrase)
+    logger.info("Indexed %d phrases in %.1f MB" % (len(index), index.memory_usage() / 1024.0 ** 2))
+    return index
+
+def dedup_phrases_table(logger, dry_run=False):
+    """
+    Removes the near-duplicate phrases from the phrases table, keeping
+    the earliest fetched copy of each, and reports how much the corpus
+    and the model trained on it shrink. If dry_run is set, only reports.
+    """
+    conn = psycopg2.connect(database=os.environ["DATABASE"], user=os.environ["USER"])
+    cur = conn.cursor()
+    cur.execute("SELECT phrase, phrase_hash FROM phrases ORDER BY fetch_date")
+
+    index = NearDuplicateIndex()
+    kept, duplicates = [], []
+    for phrase, phrase_hash in cur.fetchall():
+        if index.insert(phrase):
+            kept.append(phrase)
+        else:
+            duplicates.append((phrase, phrase_hash))
+
+    total = len(kept) + len(duplicates)
+    states_before, transitions_before, bytes_before = \
+        model_stats(kept + [phrase for phrase, _ in duplicates])
+    states_after, transitions_after, bytes_after = model_stats(kept)
+    logger.info("Phrases: %d -> %d (%d near-duplicates)" % (total, len(kept), len(duplicates)))
+    logger.info("Model states: %d -> %d, transitions: %d -> %d, size: %.1f MB -> %.1f MB" \
+                 % (states_before, states_after, transitions_before, transitions_after, \
+                    bytes_before / 1024.0 ** 2, bytes_after / 1024.0 ** 2))
+
+    if not dry_run:
+        for phrase, phrase_hash in duplicates:
+            logger.debug("Deleting near-duplicate %s" % phrase)
+            # phrase_hash can collide, so match the phrase too
+            cur.execute("DELETE FROM phrases WHERE phrase_hash = %s AND phrase = %s", \
+                        (phrase_hash, phrase))
+        conn.commit()
+        logger.info("Deleted %d near-duplicate phrases" % len(duplicates))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    dedup_phrases_table(logging, dry_run="--dry-run" in sys.argv)
@@ -8,10 +8,17 @@ import urllib2  # for making requests to the HackerNews API
 import re
 import psycopg2
 import hashlib
+import Queue
+import httplib
+import json
 import os
+import socket
+
+from htmlentitydefs import name2codepoint  # for decoding HN comment entities
+from multiprocessing.pool import ThreadPool  # bounded concurrent HN item fetches
 
-from bs4 import BeautifulSoup # for parsing HackerNews
 from hackernews import HackerNews # for getting all the HackerNews posting ids
+from phrase_dedup import load_phrase_index
 
 DEFAULT_SUBREDDITS = ["programming", "python", "coding", "java", "webdev", "machinelearning", \
                       "node", "linux"]
@@ -19,6 +26,17 @@ DEFAULT_SUBREDDITS = ["programming", "python", "coding", "java", "webdev", "mach
 NUM_SUBREDDITS_PROCESSOR = 1  # the number of subreddits each process will process
 NUM_HN_THREAD_PROCESSOR = 2 # the number of HN threads each process will process
 HN_BASE_API_ENDPOINT = "https://news.ycombinator.com/item?id="
+HN_ITEM_API_ENDPOINT = "https://hacker-news.firebaseio.com/v0/item/%d.json"
+NUM_HN_FETCH_THREADS = 32 # the max number of concurrent HN item requests per process
+HN_FETCH_TIMEOUT = 10 # seconds before a HN item request is given up on
+# whether scraped phrases are checked against an in memory index of every stored phrase
+DEDUP_AT_SCRAPE = os.environ.get("DEDUP_AT_SCRAPE", "true").lower() == "true"
+
+# precompiled so that cleaning a phrase does not recompile patterns per call
+ILLEGAL_CHARS_RE = re.compile("[(%~`<>#:@/^*&$\t?=|){}\\[\\]\"\n]")
+END_PUNCTUATION_RE = re.compile(r'[?!.]([a-zA-Z])')
+# a tag or an entity in a HN item's html body, handled in a single pass
+HN_HTML_RE = re.compile(r"<(/?)(\w*)[^>]*>|&(#[xX][0-9a-fA-F]+|#[0-9]+|\w+);")
 
 class Scraper(object):
     """
@@ -27,15 +45,19 @@ class Scraper(object):
     model.
     """
 
-    def __init__(self, logger):
+    def __init__(self, logger, phrase_index=None):
         """
         Initializes an instance of Scraper. Requires that a logger
-        to denote the progress of the Scraper to be passed in.
+        to denote the progress of the Scraper to be passed in. The
+        optional phrase_index is a NearDuplicateIndex of the phrases
+        already in the database, built from the database if not given
+        and DEDUP_AT_SCRAPE is set.
         """
         self.phrases = []
         self.hackernews = HackerNews()
         self.output = mp.Queue()
         self.logger = logger
+        self.phrase_index = phrase_index
 
 
     def gather_reddit_data(self):
@@ -131,15 +153,90 @@ class Scraper(object):
         represents all of the posts this process will gather data
         from.
         """
-        for entry in entries:
-            response = urllib2.urlopen(HN_BASE_API_ENDPOINT + str(entry)).read()
-            soup = BeautifulSoup(response, "html.parser")
-            all_comments = soup.findAll("span", {"class" : "comment"})
-            for comment in all_comments:
-                cleaned_html = re.sub('<[^<]+?>|reply|\n', "", comment.text)
-                cleaned_data = Scraper._clean_data(cleaned_html)
-                self.output.put(cleaned_data)
+        for phrase in Scraper.iter_hn_phrases(entries):
+            self.output.put(phrase)
+
+    @classmethod
+    def iter_hn_phrases(cls, entries, num_threads=NUM_HN_FETCH_THREADS):
+        """
+        Lazily yields the cleaned title and comments of each post in
+        entries. The comment trees are walked through the item API with
+        at most num_threads requests in flight; the kids of an item are
+        requested as soon as it arrives, so phrases are yielded while
+        the rest of the trees are still being fetched.
+        """
+        pool = ThreadPool(num_threads)
+        fetched = Queue.Queue()
 
+        def fetch(item_id):
+            item = None
+            try:
+                item = Scraper._fetch_hn_item(item_id)
+            finally: # always report back so the walk never waits on a lost item
+                fetched.put(item)
+
+        try:
+            pending = 0
+            for entry in entries:
+                pool.apply_async(fetch, (entry,))
+                pending += 1
+
+            while pending:
+                item = fetched.get()
+                pending -= 1
+                if not item or item.get("deleted") or item.get("dead"):
+                    continue
+                for kid in item.get("kids", []):
+                    pool.apply_async(fetch, (kid,))
+                    pending += 1
+                for field in ("title", "text"):
+                    if item.get(field):
+                        phrase = Scraper._clean_data(Scraper._strip_hn_html(item[field]))
+                        yield phrase.encode("utf8", "ignore")
+        finally:
+            pool.terminate()
+
+    @classmethod
+    def _fetch_hn_item(cls, item_id):
+        """
+        Fetches a single item from the HN item API.
+        Returns the item as a dict, or None if it could not be fetched
+        within HN_FETCH_TIMEOUT seconds.
+        """
+        try:
+            response = urllib2.urlopen(HN_ITEM_API_ENDPOINT % item_id, timeout=HN_FETCH_TIMEOUT)
+            return json.loads(response.read())
+        except (urllib2.URLError, socket.error, httplib.HTTPException, ValueError):
+            return None
+
+    @classmethod
+    def _strip_hn_html(cls, html):
+        """
+        Strips the tags out of the html body of a HN item and decodes
+        its entities. Paragraph tags are replaced by a space so that
+        the words of consecutive paragraphs are not joined.
+        """
+        return HN_HTML_RE.sub(Scraper._replace_hn_html, html)
+
+    @classmethod
+    def _replace_hn_html(cls, match):
+        """
+        Returns the replacement for a tag or entity matched by HN_HTML_RE.
+        """
+        closing, tag, entity = match.groups()
+        if entity is None:
+            return " " if tag == "p" and not closing else ""
+        if entity[0] == "#":
+            codepoint = int(entity[2:], 16) if entity[1] in "xX" else int(entity[1:])
+        else:
+            codepoint = name2codepoint.get(entity)
+            if codepoint is None:
+                return match.group(0)
+        try:
+            # unlike unichr, also decodes astral codepoints on narrow builds
+            return ("\\U%08x" % codepoint).decode("unicode-escape")
+        except UnicodeDecodeError:
+            return ""
 
     @classmethod
     def _clean_data(cls, phrase):
@@ -151,15 +248,16 @@ class Scraper(object):
         """
 
         # replace illegal chracaters
-        cleaned_phrase = re.sub("[(%~`<>#:@/^*&$\t?=|){}\\[\\]\"\n]", "", phrase)
+        cleaned_phrase = ILLEGAL_CHARS_RE.sub("", phrase)
         # make sure each period is proceeded by a space for proper punctuation
-        cleaned_phrase = re.sub(r'[?!.]([a-zA-Z])', r'. \1', cleaned_phrase)
+        cleaned_phrase = END_PUNCTUATION_RE.sub(r'. \1', cleaned_phrase)
 
         return cleaned_phrase
 
     def insert_into_db(self):
         """
-        Inserts the data into the Postgres DB.
+        Inserts the data into the Postgres DB, skipping near-duplicates
+        of the phrases already in it when DEDUP_AT_SCRAPE is set.
         """
         self.logger.debug("Inserting data in to the database")
         if len(self.phrases) == 0:
@@ -167,15 +265,25 @@ class Scraper(object):
         else:
             self.logger.debug("Attempting to insert %d phrases into the database" \
                                 % len(self.phrases))
+            if DEDUP_AT_SCRAPE and self.phrase_index is None:
+                self.phrase_index = load_phrase_index(self.logger)
+
             conn = psycopg2.connect(database=os.environ["DATABASE"], user=os.environ["USER"])
             cur = conn.cursor()
 
             successful_insertion = 0
-
-            for phrase in self.phrases:
-                self.logger.debug("Attempting to insert %s..." % phrase)
-                phrase_hash = int(hashlib.sha1(phrase).hexdigest(), 16) % 10 ** 8
-                phrase = phrase.replace("'", "''") # escape quotes
+            near_duplicates = 0
+
+            for raw_phrase in self.phrases:
+                # reposts and quoted replies
+                if self.phrase_index is not None and self.phrase_index.is_duplicate(raw_phrase):
+                    self.logger.debug("Skipping near-duplicate phrase %s" % raw_phrase)
+                    near_duplicates += 1
+                    continue
+
+                self.logger.debug("Attempting to insert %s..." % raw_phrase)
+                phrase_hash = int(hashlib.sha1(raw_phrase).hexdigest(), 16) % 10 ** 8
+                phrase = raw_phrase.replace("'", "''") # escape quotes
                 sql_string = "INSERT INTO phrases (phrase, phrase_hash) VALUES ('%s', '%d')" \
                               % (phrase, phrase_hash)
                 try:
@@ -183,9 +291,13 @@ class Scraper(object):
                     self.logger.debug("Successfully inserted %s" % phrase)
                     successful_insertion += 1
                     conn.commit()
+                    # only index what the database has, so later copies are checked against it
+                    if self.phrase_index is not None:
+                        self.phrase_index.insert(raw_phrase)
                 except psycopg2.IntegrityError: # duplicate comments not allowed
                     self.logger.warn("The phrase '%s' is already in the database" % phrase)
                     conn.rollback()
 
-            self.logger.debug("Successfully inserted %d / %d phrases into the db" \
-                                % (successful_insertion, len(self.phrases)))
+            self.logger.debug("Successfully inserted %d / %d phrases into the db, " \
+                              "skipped %d near-duplicates" \
+                                % (successful_insertion, len(self.phrases), near_duplicates))
@@ -1,13 +1,50 @@
 """
 Generates random sentences using Markov Models.
 """
+import heapq
 import psycopg2
 import random
+import resource
 import re
 import os
+import sys
 
+from collections import Counter
+from operator import itemgetter
 from nltk import bigrams  # to get tuples from a sentence in the form: (s0, s1), (s1, s2)
 
+MODEL_HALF_LIFE = 30 * 24 * 3600  # seconds for a phrase's transitions to lose half their weight
+MIN_TRANSITION_WEIGHT = 0.05  # transitions weighing less are pruned
+MIN_STATE_WEIGHT = 0.1  # states whose transitions weigh less in total are pruned
+# bytes the trained model may take, not counting the memory needed to build it
+MODEL_MEMORY_BUDGET = int(os.environ.get("MODEL_MEMORY_BUDGET", 256 * 1024 ** 2))
+QUERY_BATCH_SIZE = 2000  # rows fetched at a time while building the model
+
+def resident_memory():
+    """
+    Returns the current resident memory of this process in bytes, or
+    None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return None
+
+def peak_resident_memory():
+    """
+    Returns the peak resident memory of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on OS X and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _format_memory(size):
+    """
+    Formats a number of bytes in MB, or n/a if it is unknown.
+    """
+    return "n/a" if size is None else "%.1f MB" % (size / 1024.0 ** 2)
+
 class SentenceGenerator(object):
     """
     Generates random sentences. Since SentenceGenerator is
@@ -16,14 +53,19 @@ class SentenceGenerator(object):
     sentences.
     """
 
-    def __init__(self, classifier, logger):
+    def __init__(self, classifier, logger, required_states=()):
         """
         Constructs a new instance of SentenceGenerator with
-        an untrained Markov Model.
+        a Markov Model trained on the phrases in the database. The
+        model maps each word to a Counter of the weights of the words
+        that may follow it. The param, required_states, are the words
+        that pruning never removes, e.g. the initial words sentences
+        are generated from.
         """
         self.model = {}
         self.classifier = classifier
         self.logger = logger
+        self.required_states = list(required_states)
         self._train_model()
 
     @classmethod
@@ -35,16 +77,24 @@ class SentenceGenerator(object):
         return bool(re.match(r"\w+[:.?!*\\-]+", word))
 
 
-    def train_model(self, input_data):
+    def train_model(self, input_data, weight=1.0):
         """
         Trains the model with input_data, a simple space seperated
         English sentence(s). If the last sentence or phrase does not
         contain ending punctuation, a "." will be appended to the last
-        word contained.
+        word contained. Each transition seen is weighted by weight.
         """
         self.logger.debug("Training generator on '%s' " % input_data)
+        SentenceGenerator._train_phrase(self.model, input_data, weight)
 
-        split_data = input_data.split()
+    @classmethod
+    def _train_phrase(cls, model, input_data, weight):
+        """
+        Adds the transitions of input_data to model, each weighted by weight.
+        """
+        # interned so that a word following many states is stored once
+        split_data = [intern(word) if isinstance(word, str) else word \
+                      for word in input_data.split()]
 
         # Clean the input and make sure that the last element
         # has some form of punctuation, if not, append '.'.
@@ -56,44 +106,163 @@ class SentenceGenerator(object):
         markov_states = bigrams(split_data)
 
         for init_state, pos_state in markov_states:
-            all_pos_states = self.model.get(init_state, [])
-            all_pos_states.append(pos_state)
-            self.model[init_state] = all_pos_states
+            model.setdefault(init_state, Counter())[pos_state] += weight
 
     def _train_model(self):
         """
         Trains the model with the results back from the Postgres database.
         """
-        res = self._query_data()
-        for phrase in res:
-            self.train_model(phrase[0])
+        self.model = self._build_model()
+
+    def _build_model(self):
+        """
+        Builds a new model from the phrases in the Postgres database. The
+        transitions of each phrase are weighted by its age relative to the
+        newest phrase, halving every MODEL_HALF_LIFE seconds, and the model
+        is pruned to fit in MODEL_MEMORY_BUDGET, keeping the required states.
+        The unpruned model is built first, so building it takes more memory
+        than the budget.
+        """
+        model = {}
+        for phrase, age in self._query_data():
+            weight = 0.5 ** (max(float(age or 0), 0.0) / MODEL_HALF_LIFE)
+            SentenceGenerator._train_phrase(model, phrase, weight)
+        return SentenceGenerator._prune_model(model, MODEL_MEMORY_BUDGET, self.required_states)
+
+    def compact_model(self):
+        """
+        Rebuilds the model from the database with recency weighted,
+        pruned transitions and swaps it in for the current model.
+        Sentences keep being generated from the current model while the
+        new one is built. The current model is kept if the new one is
+        empty or lost any of the required states.
+        """
+        memory_before = resident_memory()
+        old_size = SentenceGenerator._model_memory(self.model)
+
+        model = self._build_model()
+        if not model:
+            self.logger.warning("Compacted model is empty, keeping the current model")
+            return
+        lost_states = [state for state in self.required_states \
+                       if state in self.model and state not in model]
+        if lost_states:
+            self.logger.warning("Compacted model lost the required states %s, " \
+                                "keeping the current model" % lost_states)
+            return
+
+        new_size = SentenceGenerator._model_memory(model)
+        self.model = model  # rebinding is atomic, generation never sees a partial model
+
+        self.logger.info("Compacted model from an estimated %.1f MB to %.1f MB; process " \
+                         "resident memory %s -> %s, peak %s" % (old_size / 1024.0 ** 2, \
+                         new_size / 1024.0 ** 2, _format_memory(memory_before), \
+                         _format_memory(resident_memory()), \
+                         _format_memory(peak_resident_memory())))
+
+    @classmethod
+    def _model_memory(cls, model):
+        """
+        Estimates the bytes used by model, counting each word it
+        contains once per occurrence.
+        """
+        size = sys.getsizeof(model)
+        for state, transitions in model.iteritems():
+            size += sys.getsizeof(state) + sys.getsizeof(transitions)
+            size += sum(sys.getsizeof(pos_state) + sys.getsizeof(weight) \
+                        for pos_state, weight in transitions.iteritems())
+        return size
+
+    @classmethod
+    def _filter_model(cls, model, min_weight):
+        """
+        Removes the transitions of model weighing less than min_weight and
+        the states whose transitions weigh less than MIN_STATE_WEIGHT in
+        total, in place so the model is not copied.
+        Returns the filtered model.
+        """
+        for state in model.keys():
+            transitions = model[state]
+            for pos_state in [pos_state for pos_state, weight \
+                              in transitions.iteritems() if weight < min_weight]:
+                del transitions[pos_state]
+            if not transitions or sum(transitions.itervalues()) < MIN_STATE_WEIGHT:
+                del model[state]
+        return model
+
+    @classmethod
+    def _prune_model(cls, model, memory_budget, required_states=()):
+        """
+        Prunes the rare states and low weight transitions of model. Until
+        it fits in memory_budget bytes, only the heaviest transitions that
+        are estimated to fit are kept. The heaviest transition of each of
+        required_states in model is always kept, even beyond the budget.
+        Returns the pruned model.
+        """
+        required = dict((state, max(model[state].iteritems(), key=itemgetter(1))) \
+                        for state in required_states if state in model)
+
+        pruned = SentenceGenerator._filter_model(model, MIN_TRANSITION_WEIGHT)
+        memory = SentenceGenerator._model_memory(pruned)
+        while memory > memory_budget and pruned:
+            num_transitions = sum(len(transitions) for transitions in pruned.itervalues())
+            max_transitions = int(num_transitions * memory_budget / float(memory))
+            # keep the heaviest transitions, ranked so that ties cannot exceed the budget
+            heaviest = heapq.nlargest(max_transitions, ((weight, state, pos_state) \
+                                      for state, transitions in pruned.iteritems() \
+                                      for pos_state, weight in transitions.iteritems()))
+            pruned = {}
+            for weight, state, pos_state in heaviest:
+                pruned.setdefault(state, Counter())[pos_state] = weight
+            pruned = SentenceGenerator._filter_model(pruned, MIN_TRANSITION_WEIGHT)
+            memory = SentenceGenerator._model_memory(pruned)
+
+        for state, (pos_state, weight) in required.iteritems():
+            if state not in pruned:
+                pruned[state] = Counter({pos_state : weight})
+        return pruned
+
+    @classmethod
+    def _choose_state(cls, transitions):
+        """
+        Randomly chooses the next state from transitions,
+        proportionally to the weight of each.
+        """
+        remaining = random.random() * sum(transitions.itervalues())
+        for pos_state, weight in transitions.iteritems():
+            remaining -= weight
+            if remaining < 0:
+                break
+        return pos_state
 
     def generate_sentence(self, initial_word=None):
         """
         Randomly generates a sentence with an initial word. If no initial
         word is specified, a random word will be chosen as the start word.
         """
+        # compact_model may swap in a new model, keep generating from this one
+        model = self.model
+
         if initial_word:
             # verify that its in the dictionary
-            if initial_word not in self.model:
+            if initial_word not in model:
                 raise ValueError("\'" + initial_word + "\' was not found")
             cur_state = initial_word
         else:
-            cur_state = random.choice(self.model.keys())
+            cur_state = random.choice(model.keys())
 
         # try generating a sentence 10000 times, if not possible, return err msg
         for _ in xrange(10000):
             cur_sentence = []
             cur_sentence.append(cur_state)
 
-            while not self._is_end_word(cur_state) and cur_state in self.model.keys():
+            while not self._is_end_word(cur_state) and cur_state in model:
                 # get all possible states and randomly choose a state to go to
-                all_future_states = self.model[cur_state]
-                cur_state = random.choice(all_future_states)
+                cur_state = SentenceGenerator._choose_state(model[cur_state])
                 cur_sentence.append(cur_state)
 
             # finished generating a sentence, generate a new state if not passed one
-            cur_state = initial_word if initial_word else random.choice(self.model.keys())
+            cur_state = initial_word if initial_word else random.choice(model.keys())
             full_sentence = " ".join(cur_sentence)
 
             if self.classifier.classify(full_sentence):
@@ -105,11 +274,16 @@ class SentenceGenerator(object):
 
     def _query_data(self):
         """
-        Queries the phrases to be trained on from the PostgresDB.
+        Queries the phrases to be trained on from the PostgresDB along
+        with their age in seconds, relative to the newest phrase so that
+        a corpus which is no longer growing does not decay away. The rows
+        are streamed from a server side cursor rather than all fetched.
         """
         self.logger.debug("Querying phrases from the DB...")
         conn = psycopg2.connect(database=os.environ["DATABASE"], user=os.environ["USER"])
-        cur = conn.cursor()
-        cur.execute("SELECT phrase FROM phrases ORDER BY fetch_date DESC")
+        cur = conn.cursor("phrases_with_age")
+        cur.itersize = QUERY_BATCH_SIZE
+        cur.execute("SELECT phrase, EXTRACT(EPOCH FROM max(fetch_date) OVER () - fetch_date) " \
+                    "FROM phrases ORDER BY fetch_date DESC")
         self.logger.debug("Success, returning results")
-        return iter(cur.fetchall())
+        return iter(cur)
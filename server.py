@@ -15,8 +15,10 @@ from sentence_classifier import SentenceClassifier
 
 app = Flask(__name__)
 generate = None
+phrase_index = None
 
 SCRAPING_INTERVAL = 3600
+COMPACTION_INTERVAL = 6 * 3600
 
 @app.route("/sentence")
 def generate_sentence():
@@ -76,23 +78,41 @@ def setup_logger():
 
 def scrape():
     """
-    Sets up the scraper to scrape HN and Reddit.
+    Sets up the scraper to scrape HN and Reddit. Unless DEDUP_AT_SCRAPE
+    is turned off, the index of phrases already in the DB is built by the
+    first scrape and kept for the life of the server, growing by roughly
+    350 MB per million phrases.
     """
+    global phrase_index
     app.logger.info("Scraping Reddit")
 
-    scrape_reddit = Scraper(app.logger)
+    scrape_reddit = Scraper(app.logger, phrase_index)
     scrape_reddit.gather_reddit_data()
 
     app.logger.info("Finished gathering data, inserting into DB")
     scrape_reddit.insert_into_db()
+    phrase_index = scrape_reddit.phrase_index
 
     app.logger.info("Finished inserting into DB, sleeping for %d minutes..." % \
             (SCRAPING_INTERVAL / 60.0))
     threading.Timer(SCRAPING_INTERVAL, scrape).start()
 
+def compact():
+    """
+    Rebuilds the sentence generator's model from the latest phrases,
+    pruned and weighted by recency, without blocking requests.
+    """
+    app.logger.info("Compacting the sentence generator's model")
+    generate.compact_model()
+
+    app.logger.info("Finished compacting, sleeping for %d minutes..." % \
+            (COMPACTION_INTERVAL / 60.0))
+    threading.Timer(COMPACTION_INTERVAL, compact).start()
+
 if __name__ == "__main__":
     setup_logger()
     classifier = SentenceClassifier(app.logger)
-    generate = SentenceGenerator(classifier, app.logger)
-    scrape()
+    generate = SentenceGenerator(classifier, app.logger, required_states=["I"])
+    threading.Thread(target=scrape).start()
+    threading.Timer(COMPACTION_INTERVAL, compact).start()
     app.run(port=int(os.environ["FLASK_PORT"]))
@@ -0,0 +1,106 @@
+from phrase_dedup import NearDuplicateIndex, model_stats
+import unittest
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    """
+    Tests external functionality of the NearDuplicateIndex class.
+    """
+
+    def setUp(self):
+        self.index = NearDuplicateIndex()
+
+    def test_insert_new_phrase(self):
+        """
+        Test that a phrase not yet in the index is indexed.
+        """
+        self.assertTrue(self.index.insert("The brown fox jumped over the lazy dog."))
+        self.assertEquals(len(self.index), 1)
+
+    def test_insert_exact_duplicate(self):
+        """
+        Test that an exact copy of an indexed phrase is rejected,
+        ignoring case and punctuation.
+        """
+        self.index.insert("The brown fox jumped over the lazy dog.")
+        self.assertFalse(self.index.insert("the brown fox jumped over the lazy dog"))
+        self.assertEquals(len(self.index), 1)
+
+    def test_insert_near_duplicate(self):
+        """
+        Test that a repost with a trailing word changed is rejected.
+        """
+        self.index.insert("I spent all of yesterday refactoring the build scripts "
+                          "so that the tests finally run on every commit again.")
+        self.assertTrue(self.index.is_duplicate("I spent all of yesterday refactoring "
+                                                "the build scripts so that the tests "
+                                                "finally run on every commit again!!"))
+        self.assertFalse(self.index.insert("I spent all of yesterday refactoring the "
+                                           "build scripts so that the tests finally run "
+                                           "on every commit once more."))
+
+    def test_insert_at_threshold(self):
+        """
+        Test that phrases exactly as similar as the threshold are
+        found to be near-duplicates.
+        """
+        missed = 0
+        for i in xrange(50):
+            words = ["w%d_%d" % (i, j) for j in xrange(10)]
+            # 8 of the 10 distinct bigrams are shared, a Jaccard similarity of 0.8
+            self.index.insert(" ".join(words))
+            if self.index.insert(" ".join(words[:9] + ["x%d" % i])):
+                missed += 1
+        self.assertEquals(missed, 0)
+
+    def test_insert_below_threshold(self):
+        """
+        Test that phrases less similar than the threshold are indexed.
+        """
+        words = ["w%d" % j for j in xrange(10)]
+        self.index.insert(" ".join(words))
+        # 7 of the 11 distinct bigrams are shared, a Jaccard similarity of 0.64
+        self.assertTrue(self.index.insert(" ".join(words[:8] + ["x", "y"])))
+
+    def test_insert_grows_table(self):
+        """
+        Test that indexed phrases are still found after the band
+        table has grown.
+        """
+        phrases = ["phrase number %d of many %d" % (i, i * 7) for i in xrange(500)]
+        for phrase in phrases:
+            self.assertTrue(self.index.insert(phrase))
+        self.assertTrue(all(self.index.is_duplicate(phrase) for phrase in phrases))
+
+    def test_insert_distinct_phrases(self):
+        """
+        Test that unrelated phrases are all indexed.
+        """
+        self.index.insert("The brown fox jumped over the lazy dog.")
+        self.assertTrue(self.index.insert("Today I plan to fix the flaky login tests."))
+        self.assertEquals(len(self.index), 2)
+
+    def test_insert_empty_phrase(self):
+        """
+        Test that a phrase without words is never a near-duplicate.
+        """
+        self.assertTrue(self.index.insert(""))
+        self.assertTrue(self.index.insert("..."))
+        self.assertEquals(len(self.index), 0)
+
+    def test_invalid_bands(self):
+        """
+        Test that a ValueError is thrown if the signature cannot
+        be split evenly into bands.
+        """
+        self.assertRaises(ValueError, lambda: NearDuplicateIndex(num_perm=64, num_bands=7))
+
+    def test_model_stats(self):
+        """
+        Test that the states and distinct transitions of a trained model
+        are counted.
+        """
+        states, transitions, _ = model_stats(["The brown brown fox.", "The brown fox."])
+        self.assertEquals((states, transitions), (2, 3))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+from phrase_dedup import NearDuplicateIndex
+from scraper import Scraper
+import json
+import logging
+import scraper
+import socket
+import StringIO
+import unittest
+
+class TestScraper(unittest.TestCase):
+    """
+    Tests the HN ingestion of the Scraper class.
+    """
+
+    def setUp(self):
+        self.items = {}
+        self.urlopen = scraper.urllib2.urlopen
+
+        def urlopen(url, timeout=None):
+            item_id = int(url.rsplit("/", 1)[1].split(".")[0])
+            if item_id not in self.items:
+                raise socket.timeout("timed out")
+            return StringIO.StringIO(json.dumps(self.items[item_id]))
+
+        scraper.urllib2.urlopen = urlopen
+
+    def tearDown(self):
+        scraper.urllib2.urlopen = self.urlopen
+
+    def test_strip_hn_html_entities(self):
+        """
+        Test that numeric, named and astral entities are decoded
+        and unknown entities are left as is.
+        """
+        self.assertEquals(Scraper._strip_hn_html(u"it&#x27;s &amp; &#62; &#x1F600; &bogus;"),
+                          u"it's & > \U0001F600 &bogus;")
+
+    def test_strip_hn_html_paragraphs(self):
+        """
+        Test that tags are removed and paragraphs are separated by a space.
+        """
+        self.assertEquals(Scraper._strip_hn_html(u"First <i>one</i>.<p>Second "
+                                                 u"<a href=\"x\">link</a>.</p>"),
+                          u"First one. Second link.")
+
+    def test_iter_hn_phrases_titles_and_nested_kids(self):
+        """
+        Test that the title of the post and all of its nested
+        comments are yielded.
+        """
+        self.items = {1 : {"title" : "Show HN", "kids" : [2]},
+                      2 : {"text" : "Top comment", "kids" : [3]},
+                      3 : {"text" : "Nested<p>reply"}}
+        self.assertEquals(sorted(Scraper.iter_hn_phrases([1])),
+                          ["Nested reply", "Show HN", "Top comment"])
+
+    def test_iter_hn_phrases_skips_deleted_and_dead(self):
+        """
+        Test that deleted and dead comments and their kids are skipped.
+        """
+        self.items = {1 : {"title" : "Ask HN", "kids" : [2, 3]},
+                      2 : {"deleted" : True, "kids" : [4]},
+                      3 : {"text" : "flagged", "dead" : True},
+                      4 : {"text" : "orphan"}}
+        self.assertEquals(list(Scraper.iter_hn_phrases([1])), ["Ask HN"])
+
+    def test_iter_hn_phrases_failed_fetch(self):
+        """
+        Test that a comment which cannot be fetched does not stop the others.
+        """
+        self.items = {1 : {"title" : "Ask HN", "kids" : [2, 3]},
+                      3 : {"text" : "still here"}}
+        self.assertEquals(sorted(Scraper.iter_hn_phrases([1])), ["Ask HN", "still here"])
+
+class FakeConnection(object):
+    """
+    A connection to a phrases table that refuses the phrases in rejected.
+    """
+
+    def __init__(self, rejected):
+        self.rejected = rejected
+        self.inserted = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql_string):
+        if any(phrase in sql_string for phrase in self.rejected):
+            raise scraper.psycopg2.IntegrityError()
+        self.inserted.append(sql_string)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class TestInsertIntoDb(unittest.TestCase):
+    """
+    Tests the near-duplicate checks of Scraper.insert_into_db.
+    """
+
+    def setUp(self):
+        self.connect = scraper.psycopg2.connect
+        self.environ = dict(scraper.os.environ)
+        scraper.os.environ.update({"DATABASE" : "scrumgen", "USER" : "scrumgen"})
+
+    def tearDown(self):
+        scraper.psycopg2.connect = self.connect
+        scraper.os.environ.clear()
+        scraper.os.environ.update(self.environ)
+
+    def _insert(self, phrases, rejected=()):
+        conn = FakeConnection(rejected)
+        scraper.psycopg2.connect = lambda **kwargs: conn
+        scrape = Scraper.__new__(Scraper)
+        scrape.logger = logging
+        scrape.phrases = phrases
+        scrape.phrase_index = self.index
+        scrape.insert_into_db()
+        return conn.inserted
+
+    def test_skips_near_duplicates_in_batch(self):
+        """
+        Test that a near-copy of a phrase inserted earlier is skipped.
+        """
+        self.index = NearDuplicateIndex()
+        inserted = self._insert(["I spent all day fixing the flaky login tests again.",
+                                 "I spent all day fixing the flaky login tests again!"])
+        self.assertEquals(len(inserted), 1)
+
+    def test_rejected_phrase_not_indexed(self):
+        """
+        Test that a phrase the database refused is not indexed,
+        so later copies of it are still inserted.
+        """
+        self.index = NearDuplicateIndex()
+        phrase = "I spent all day fixing the flaky login tests again."
+        self._insert([phrase], rejected=[phrase])
+        self.assertEquals(len(self.index), 0)
+        self.assertEquals(len(self._insert([phrase])), 1)
+
+if __name__ == "__main__":
+    unittest.main()